@@ -10,7 +10,8 @@ Things you can do with this script:
     or just specific hours of service (e.g., 7am-9am only)
 
     As of May 2022, this script does NOT let you specify which days of the week (service_id) you
-    want service captured for.
+    want service captured for. You can, however, limit outputs to service that runs on every
+    weekday (per calendar.txt) by setting weekdays_only = True.
           
 Author: Darren Conly
 Last Updated: May 2022
@@ -20,40 +21,52 @@ Python Version: 3.x
 """
 import pdb
 import os
+import hashlib
 import datetime as dt
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import arcpy
 import pandas as pd
 import numpy as np
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pacsv = None # pyarrow not installed; txt_to_df will use pandas' default csv reader
+
 #===============================input info=============================
 
 class MakeGTFSGISData(object):
     arcpy.env.overwriteOutput = True
     
-    def __init__(self, gtfs_dir, gis_workspace, data_year):
+    # characters not allowed in feature class names, and what to replace them with
+    forbidden_chars = str.maketrans({"&":'And','%':'pct','/':'_', ' ':'', '-':'', '(':'_',
+                                     ')':'_'})
+    
+    # part of every cache file name. Bump when the way cached tables are built changes,
+    # so cache files written by older versions of this script are not reused.
+    cache_version = 1
+    
+    def __init__(self, gtfs_dir, gis_workspace, data_year, weekdays_only=False, use_cache=False):
         arcpy.env.workspace = gis_workspace
         self.workspace = gis_workspace
         
-        os.chdir(gtfs_dir)
+        self.gtfs_dir = Path(gtfs_dir)
+        self.use_cache = use_cache # if True, save parsed tables as parquet files in gtfs_dir for faster re-runs
 
         self.data_year = data_year
         
         # standard gtfs input files
-        self.txt_agency = 'agency.txt'
-        self.txt_trips = 'trips.txt'
-        self.txt_routes = 'routes.txt'
-        self.txt_stops = 'stops.txt'
-        self.txt_stoptimes = 'stop_times.txt'
-        self.txt_shapes = 'shapes.txt'
-        self.txt_calendar = 'calendar.txt'
-
-        # inputs as dataframs
-        self.df_agency = self.txt_to_df(self.txt_agency)
-        # self.df_calendar = self.txt_to_df(self.txt_calendar)
-        self.df_routes = self.txt_to_df(self.txt_routes)
-        self.df_trips =self.txt_to_df(self.txt_trips)
-        
+        self.txt_agency = self.gtfs_dir / 'agency.txt'
+        self.txt_trips = self.gtfs_dir / 'trips.txt'
+        self.txt_routes = self.gtfs_dir / 'routes.txt'
+        self.txt_stops = self.gtfs_dir / 'stops.txt'
+        self.txt_stoptimes = self.gtfs_dir / 'stop_times.txt'
+        self.txt_shapes = self.gtfs_dir / 'shapes.txt'
+        self.txt_calendar = self.gtfs_dir / 'calendar.txt'
+
         # shape.txt cols
         self.f_shapeid = 'shape_id'
         self.f_pt_seq = 'shape_pt_sequence'
@@ -64,10 +77,6 @@ class MakeGTFSGISData(object):
         self.f_agencyid = 'agency_id'
         self.f_agencyname = 'agency_name'
 
-        # get agency name from GTFS file
-        self.agency = self.df_agency[self.f_agencyname][0] #agency name
-        self.agency_formatted = self.remove_forbidden_chars(self.agency)
-        
         # route-level cols
         self.f_routeid = 'route_id'
         self.f_routesname = 'route_short_name'
@@ -89,8 +98,8 @@ class MakeGTFSGISData(object):
 
         # calendar cols
         self.f_svc_id = 'service_id'  # for joining to trip table
-        self.start_date = 'start_date'
-        self.end_date = 'end_date'
+        self.f_start_date = 'start_date'
+        self.f_end_date = 'end_date'
 
         # other fields
         self.f_tripcnt_day = 'tripcnt_day' # count of weekday trips made for given route shape
@@ -111,40 +120,247 @@ class MakeGTFSGISData(object):
         
         #SACOG's system: NAD_1983_StatePlane_California_II_FIPS_0402_Feet
         self.sacog_projexn = arcpy.SpatialReference(2226)
-
+        
+        # features are first written in WGS1984 to this workspace, then projected
+        # in one step into gis_workspace
+        self.mem_workspace = 'memory'
+
+        # ID and time columns are always read as text. Otherwise IDs like "081" lose their
+        # leading zeros and the csv reader may try to parse "25:10:00" as a time of day.
+        self.str_cols = [self.f_agencyid, self.f_routeid, self.f_routesname, self.f_tripid,
+                         self.f_shapeid, self.f_svc_id, self.f_stopid, self.f_depart_time,
+                         self.f_arrive_time]
+        
+        # only load the trips.txt and stop_times.txt columns used by this script
+        self.cols_trips = [self.f_tripid, self.f_routeid, self.f_svc_id, self.f_shapeid, self.f_tripdir]
+        self.cols_stoptimes = [self.f_tripid, self.f_stopid, self.f_stopseq, self.f_arrive_time,
+                               self.f_depart_time]
+        self.cols_stops = [self.f_stopid, self.f_stoplat, self.f_stoplon]
+        self.cols_shapes = [self.f_shapeid, self.f_pt_lat, self.f_pt_lon, self.f_pt_seq]
+        
+        # trips.txt columns that GTFS does not require. If a feed leaves them out, they are loaded as blanks.
+        self.optcols_trips = [self.f_shapeid, self.f_tripdir]
+        
+        # known dtypes of required numeric columns, so the csv reader does not have to infer them.
+        # direction_id is optional and may be blank, so it is read as float.
+        self.dtypes_trips = {self.f_tripdir: 'float64'}
+        self.dtypes_stoptimes = {self.f_stopseq: 'int32'}
+        self.dtypes_stops = {self.f_stoplat: 'float64', self.f_stoplon: 'float64'}
+        self.dtypes_shapes = {self.f_pt_seq: 'int32', self.f_pt_lat: 'float64', self.f_pt_lon: 'float64'}
+        
+        # stops.txt and shapes.txt are only needed for some outputs, so they are read on first use
+        # (see df_stops and df_shapes) and then reused by every method that needs them.
+        self._df_stops = None
+        self._df_shapes = None
+        
+        # results of agg_to_tripshp and augment_shpstbl, saved the first time each is run
+        self._df_tripshp = None
+        self._df_shapes_aug = None
+
+        # weekday service can only be picked out from calendar.txt. Some feeds only have calendar_dates.txt
+        if weekdays_only and not self.txt_calendar.exists():
+            print("warning: calendar.txt not found, so trips cannot be filtered to weekday service. " \
+                  "Loading trips for all service types.")
+            weekdays_only = False
+
+        # inputs as dataframes. Files are independent of each other, so read them concurrently.
+        # Pool is kept small because pyarrow already uses multiple threads to parse each file.
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            fut_agency = executor.submit(self.txt_to_df, self.txt_agency)
+            # fut_calendar = executor.submit(self.txt_to_df, self.txt_calendar)
+            fut_routes = executor.submit(self.txt_to_df, self.txt_routes)
+            fut_trips = executor.submit(self.cached_load, self.txt_trips,
+                                        lambda: self.txt_to_df(self.txt_trips, usecolumns=self.cols_trips,
+                                                               dtypes=self.dtypes_trips,
+                                                               optional_cols=self.optcols_trips),
+                                        schema=(self.cols_trips, self.dtypes_trips))
+            if not weekdays_only:
+                fut_stoptimes = executor.submit(self.cached_load, self.txt_stoptimes, self.load_stoptimes,
+                                                schema=(self.cols_stoptimes, self.dtypes_stoptimes))
+            
+            self.df_agency = fut_agency.result()
+            self.df_routes = fut_routes.result()
+            self.df_trips = fut_trips.result()
+            
+            if weekdays_only:
+                # only keep trips whose service runs every weekday. Stop times for all other
+                # trips are dropped while stop_times.txt is being read.
+                weekday_svc_ids = self.get_weekday_svc_ids()
+                self.df_trips = self.df_trips.loc[self.df_trips[self.f_svc_id].isin(weekday_svc_ids)] \
+                    .reset_index(drop=True)
+                # which stop times are kept depends on trips.txt and calendar.txt too
+                self.df_stoptimes = self.cached_load(self.txt_stoptimes,
+                                                     lambda: self.load_stoptimes(self.df_trips[self.f_tripid]),
+                                                     cache_tag='_weekdays',
+                                                     schema=(self.cols_stoptimes, self.dtypes_stoptimes),
+                                                     depends_on=(self.txt_trips, self.txt_calendar))
+            else:
+                self.df_stoptimes = fut_stoptimes.result()
+        
+        # set null direction vals to zero. direction_id is read as float so blanks can load; store it
+        # as an integer so outputs show 0/1 instead of 0.0/1.0
+        self.df_trips[self.f_tripdir] = self.df_trips[self.f_tripdir].fillna(0).astype('int8')
+        
+        # trip table IDs are used as join and groupby keys throughout, so store them as categoricals.
+        # groupbys on these columns must use observed=True to avoid returning every combination of categories.
+        for col in (self.f_tripid, self.f_routeid, self.f_shapeid, self.f_svc_id, self.f_tripdir):
+            self.df_trips[col] = self.df_trips[col].astype('category')
+        
+        # give stop_times' trip_id the same categories, so trip_id joins compare category codes
+        # instead of matching strings against categories. Stop times for trips not in trips.txt
+        # are dropped first; every join to the trip table already leaves them out.
+        trip_id_dtype = pd.CategoricalDtype(self.df_trips[self.f_tripid].cat.categories)
+        self.df_stoptimes = self.df_stoptimes.loc[self.df_stoptimes[self.f_tripid].isin(trip_id_dtype.categories)] \
+            .reset_index(drop=True)
+        self.df_stoptimes[self.f_tripid] = self.df_stoptimes[self.f_tripid].astype(trip_id_dtype)
+        
+        # get agency name from GTFS file
+        self.agency = self.df_agency[self.f_agencyname][0] #agency name
+        self.agency_formatted = self.remove_forbidden_chars(self.agency)
+        
         
     
     #=================DEFINE FUNCTIONS=================================
-    def txt_to_df(self, in_txt, usecolumns=None, txt_delim=','):
-        '''reads in txt or csv file to pandas df'''
-        out_df = pd.read_csv(in_txt, usecols=usecolumns)
+    @property
+    def df_stops(self):
+        '''stops.txt as dataframe, read the first time it is needed'''
+        if self._df_stops is None:
+            self._df_stops = self.txt_to_df(self.txt_stops, usecolumns=self.cols_stops,
+                                            dtypes=self.dtypes_stops)
+        return self._df_stops
+    
+    @property
+    def df_shapes(self):
+        '''shapes.txt as dataframe, read the first time it is needed. Raises FileNotFoundError
+        if the feed has no shapes.txt'''
+        if self._df_shapes is None:
+            self._df_shapes = self.cached_load(self.txt_shapes,
+                                               lambda: self.txt_to_df(self.txt_shapes, usecolumns=self.cols_shapes,
+                                                                      dtypes=self.dtypes_shapes),
+                                               schema=(self.cols_shapes, self.dtypes_shapes))
+        return self._df_shapes
+    
+    def txt_to_df(self, in_txt, usecolumns=None, txt_delim=',', dtypes=None, optional_cols=None):
+        '''reads in txt or csv file to pandas df. Uses pyarrow's multithreaded csv
+        reader if pyarrow is installed, otherwise falls back to pandas' default reader.
+        dtypes = optional {column: dtype name} for columns whose type is known ahead of time,
+        e.g. {'stop_sequence': 'int32'}. ID and time columns are always read as text.
+        optional_cols = columns in usecolumns that the file may not have; if missing, they
+        are added as blank columns instead of raising an error.'''
+        col_dtypes = {col: 'str' for col in self.str_cols}
+        if dtypes is not None:
+            col_dtypes.update(dtypes)
+        optional_cols = optional_cols or []
+        
+        # neither reader below complains about missing optional columns, so check for
+        # missing required columns up front from the file's header row
+        if usecolumns is not None and optional_cols:
+            file_cols = pd.read_csv(in_txt, sep=txt_delim, nrows=0).columns
+            missing_required = [col for col in usecolumns if col not in file_cols and col not in optional_cols]
+            if missing_required:
+                raise ValueError("{} is missing required columns {}".format(in_txt, missing_required))
+            
+        if pacsv is None:
+            usecols = usecolumns if not optional_cols else (lambda col: col in usecolumns)
+            out_df = pd.read_csv(in_txt, usecols=usecols, sep=txt_delim, dtype=col_dtypes,
+                                 low_memory=False)
+            if optional_cols:
+                for col in optional_cols:
+                    if col not in out_df.columns:
+                        out_df[col] = pd.Series(np.nan, index=out_df.index, dtype=col_dtypes.get(col, 'float64'))
+                out_df = out_df[usecolumns]
+            return out_df
+
+        read_opts = pacsv.ReadOptions(use_threads=True, block_size=64 << 20) # 64MB blocks
+        parse_opts = pacsv.ParseOptions(delimiter=txt_delim)
+        convert_opts = pacsv.ConvertOptions(include_columns=usecolumns, strings_can_be_null=True,
+                                            include_missing_columns=bool(optional_cols),
+                                            column_types={col: pa.from_numpy_dtype(np.dtype(dtype))
+                                                          for col, dtype in col_dtypes.items()})
+        
+        table = pacsv.read_csv(in_txt, read_options=read_opts, parse_options=parse_opts,
+                               convert_options=convert_opts)
+        out_df = table.to_pandas()
         return out_df
     
+    def cached_load(self, in_txt, loader_fn, cache_tag='', schema=None, depends_on=()):
+        '''returns the dataframe made by loader_fn. If use_cache is True, the dataframe is saved as a
+        parquet file next to in_txt, and later runs read the parquet file instead, as long as it is
+        newer than in_txt and every file in depends_on. Parquet keeps dtypes and reads much faster
+        than re-parsing the txt file.
+        schema = columns and dtypes loader_fn reads with. These go into the cache file name, so a cache
+        written with different columns or dtypes is not reused.
+        depends_on = any other input files loader_fn reads, e.g. calendar.txt when filtering by service.'''
+        if not self.use_cache or pacsv is None:
+            return loader_fn()
+        
+        schema_key = hashlib.md5(repr((self.cache_version, self.str_cols, schema)).encode()).hexdigest()[:8]
+        cache_file = in_txt.with_name("{}{}_{}.gtfs_cache.parquet".format(in_txt.stem, cache_tag, schema_key))
+        
+        src_mtime = max(f.stat().st_mtime for f in (in_txt, *depends_on))
+        if cache_file.exists() and cache_file.stat().st_mtime > src_mtime:
+            return pd.read_parquet(cache_file)
+        
+        out_df = loader_fn()
+        try:
+            out_df.to_parquet(cache_file, engine='pyarrow', compression='zstd', index=False)
+        except OSError:
+            print("warning: could not write cache file {}. Will re-read {} on next run." \
+                  .format(cache_file, in_txt.name))
+        
+        return out_df
+    
+    def load_stoptimes(self, valid_trip_ids=None):
+        '''loads stop_times.txt, sorted so each trip's stops are contiguous and in sequence order.
+        If valid_trip_ids specified, only stop times for those trips are kept.'''
+        if valid_trip_ids is None:
+            df_stoptimes = self.txt_to_df(self.txt_stoptimes, usecolumns=self.cols_stoptimes,
+                                          dtypes=self.dtypes_stoptimes)
+        else:
+            df_stoptimes = self.load_stoptimes_filtered(valid_trip_ids)
+        
+        df_stoptimes = df_stoptimes.sort_values([self.f_tripid, self.f_stopseq], kind='stable',
+                                                ignore_index=True)
+        return df_stoptimes
+    
+    def get_weekday_svc_ids(self):
+        '''returns service_ids from calendar.txt whose service runs on every weekday'''
+        cols_cal = [self.f_svc_id] + self.weekdays
+        df_cal = pd.read_csv(self.txt_calendar, usecols=cols_cal, dtype={self.f_svc_id: str})
+        
+        runs_all_weekdays = (df_cal[self.weekdays] == 1).all(axis=1)
+        return df_cal.loc[runs_all_weekdays, self.f_svc_id]
+    
+    def load_stoptimes_filtered(self, valid_trip_ids, chunksize=1_000_000):
+        '''reads stop_times.txt in chunks, only keeping rows for the specified trip_ids, so
+        that the full stop_times table never needs to be held in memory at once.'''
+        col_dtypes = {col: 'str' for col in self.str_cols if col in self.cols_stoptimes}
+        col_dtypes.update(self.dtypes_stoptimes)
+        
+        parts = []
+        for chunk in pd.read_csv(self.txt_stoptimes, usecols=self.cols_stoptimes, dtype=col_dtypes,
+                                 chunksize=chunksize):
+            parts.append(chunk.loc[chunk[self.f_tripid].isin(valid_trip_ids)])
+            
+        df_out = pd.concat(parts, ignore_index=True)
+        return df_out
+    
     def remove_forbidden_chars(self, in_str):
         '''Replaces forbidden characters with acceptable characters'''
-        repldict = {"&":'And','%':'pct','/':'_', ' ':'', '-':'', '(':'_',
-                    ')':'_'}
-
-        out_str = in_str
-        for old, new in repldict.items():
-            if old in out_str:
-                out_str = out_str.replace(old, new)
-            else:
-                continue
+        out_str = in_str.translate(self.forbidden_chars)
         return out_str
 
     # for each GTFS trip shape, get count of its trips per non-holiday weekday, route name, trip direction
     def agg_to_tripshp(self):
-        pd.set_option('mode.chained_assignment', None) # turn off pandas SettingWithCopyWarning
+        if self._df_tripshp is not None:
+            return self._df_tripshp
         
         # from trips table, get count of trips grouped by service_id, route_id, shape_id, direction_id
         trip_cols = [self.f_routeid, self.f_svc_id, self.f_shapeid, self.f_tripid, self.f_tripdir]
         df_trips = self.df_trips[trip_cols]
-        
-        df_trips.loc[pd.isnull(df_trips[self.f_tripdir]), self.f_tripdir] = 0 # set null direction vals to zero
 
-        trips_x_shapedir = df_trips.groupby([self.f_shapeid, self.f_routeid, self.f_svc_id, self.f_tripdir]) \
-                           .count().reset_index()
+        trips_x_shapedir = df_trips.groupby([self.f_shapeid, self.f_routeid, self.f_svc_id, self.f_tripdir],
+                                            observed=True).count().reset_index()
 
         trips_x_shapedir = trips_x_shapedir.rename(columns = {self.f_tripid: self.f_tripcnt_day})
 
@@ -160,12 +376,37 @@ class MakeGTFSGISData(object):
         df_out = df_out[[self.f_shapeid, self.f_agencyname, self.f_routeid, self.f_routesname, self.f_routelname, \
                          self.f_svc_id, self.f_tripdir, self.f_tripcnt_day]]
 
+        self._df_tripshp = df_out
         return df_out
     
     
         
     
     
+    def get_shape_coords(self, df_shapes):
+        '''returns dict of {shape_id: (lons, lats, shape source)}, with each shape's points
+        in sequence order so trip lines draw correctly. The shapes table is sorted once
+        and sliced, rather than filtered and sorted separately for every shape.'''
+        shape_codes, shape_ids = pd.factorize(df_shapes[self.f_shapeid], sort=False)
+        order = np.lexsort((df_shapes[self.f_pt_seq].to_numpy(), shape_codes))
+        
+        shape_codes = shape_codes[order]
+        lons = df_shapes[self.f_pt_lon].to_numpy(dtype=np.float64)[order]
+        lats = df_shapes[self.f_pt_lat].to_numpy(dtype=np.float64)[order]
+        shp_sources = df_shapes[self.f_shpsrc].to_numpy()[order]
+        
+        # first row of each shape in the sorted arrays. Code of -1 means null shape_id.
+        codes, starts = np.unique(shape_codes, return_index=True)
+        ends = np.append(starts[1:], len(shape_codes))
+        
+        shape_coords = {}
+        for code, start, end in zip(codes, starts, ends):
+            if code < 0:
+                continue
+            shape_coords[shape_ids[code]] = (lons[start:end], lats[start:end], shp_sources[start])
+            
+        return shape_coords
+    
     #make line shape for each route shape--this returns all versions of a route's geometry
     def make_trip_shp(self):
         '''line shapes with data on count of trips following each shape, further
@@ -175,60 +416,55 @@ class MakeGTFSGISData(object):
         
         
         fc_linshps = "GTFSLines_{}{}".format(self.agency_formatted, self.data_year)
+        fc_linshps_wgs = os.path.join(self.mem_workspace, fc_linshps) # unprojected lines
         
-        if (arcpy.Exists(fc_linshps)):
-        	arcpy.Delete_management(fc_linshps)
+        if (arcpy.Exists(fc_linshps_wgs)):
+        	arcpy.Delete_management(fc_linshps_wgs)
         	
         #add route file fields
-        arcpy.CreateFeatureclass_management(self.workspace, fc_linshps,"POLYLINE","","","", self.sacog_projexn)
-        arcpy.AddField_management(fc_linshps, self.f_shpsrc, "TEXT", "", "", 20) # whether shape from shapes.txt or stoptimes.txt
-        arcpy.AddField_management(fc_linshps, self.f_shapeid, "TEXT", "", "", 40)
-        arcpy.AddField_management(fc_linshps, self.f_agencyname , "TEXT", "", "", 40)
-        arcpy.AddField_management(fc_linshps, self.f_routeid , "TEXT", "", "", 50)
-        arcpy.AddField_management(fc_linshps, self.f_routesname , "TEXT", "", "", 20)
-        arcpy.AddField_management(fc_linshps, self.f_routelname , "TEXT", "", "", 100)
-        arcpy.AddField_management(fc_linshps, self.f_svc_id , "TEXT", "", "", 50)
-        arcpy.AddField_management(fc_linshps, self.f_tripdir,"TEXT","","", 1)
-        arcpy.AddField_management(fc_linshps, self.f_tripcnt_day, "SHORT",)
-        
-        data_records = data_df.to_dict('records') # [{colA:val1, ColB: val1},{ColA:val2, ColB:val2}...]
-
+        arcpy.CreateFeatureclass_management(self.mem_workspace, fc_linshps,"POLYLINE","","","", self.spatialref_wgs)
+        arcpy.AddField_management(fc_linshps_wgs, self.f_shpsrc, "TEXT", "", "", 20) # whether shape from shapes.txt or stoptimes.txt
+        arcpy.AddField_management(fc_linshps_wgs, self.f_shapeid, "TEXT", "", "", 40)
+        arcpy.AddField_management(fc_linshps_wgs, self.f_agencyname , "TEXT", "", "", 40)
+        arcpy.AddField_management(fc_linshps_wgs, self.f_routeid , "TEXT", "", "", 50)
+        arcpy.AddField_management(fc_linshps_wgs, self.f_routesname , "TEXT", "", "", 20)
+        arcpy.AddField_management(fc_linshps_wgs, self.f_routelname , "TEXT", "", "", 100)
+        arcpy.AddField_management(fc_linshps_wgs, self.f_svc_id , "TEXT", "", "", 50)
+        arcpy.AddField_management(fc_linshps_wgs, self.f_tripdir,"TEXT","","", 1)
+        arcpy.AddField_management(fc_linshps_wgs, self.f_tripcnt_day, "SHORT",)
+        
         data_fields = [col for col in data_df.columns]
+        # attribute fields in feature class field order, looked up once rather than for every row
+        output_fields = [f.name for f in arcpy.ListFields(fc_linshps_wgs) if f.name in data_fields]
         
-        route_cur = arcpy.da.InsertCursor(fc_linshps,[self.f_esri_shape, self.f_shpsrc] + data_fields)
+        shape_ids = data_df[self.f_shapeid].tolist()
+        
+        route_cur = arcpy.da.InsertCursor(fc_linshps_wgs,[self.f_esri_shape, self.f_shpsrc] + output_fields)
 
         print("writing rows to feature class {}...".format(fc_linshps))
         
         df_shapes_aug = self.augment_shpstbl() # df fields = shape id, lat, long, sequence, shape source
         
-        for row in data_records:
-
-            shape_id = row[self.f_shapeid]
-            #put points into order so trip line draws correctly
-            thisshape_df = df_shapes_aug[df_shapes_aug[self.f_shapeid] == shape_id] \
-                           .sort_values(by = self.f_pt_seq)
-
-            shp_source = list(thisshape_df[self.f_shpsrc])[0]
-
-            lats = list(thisshape_df[self.f_pt_lat])
-            lons = list(thisshape_df[self.f_pt_lon])
-            array = arcpy.Array()
-            pt = arcpy.Point()
-            for idx in range(0, len(lats)):   
-                pt.X = float(lons[idx])
-                pt.Y = float(lats[idx])
-                array.add(pt)    
-            polyline = arcpy.Polyline(array, self.spatialref_wgs)
-            if self.sacog_projexn != self.spatialref_wgs:
-                polyline = polyline.projectAs(self.sacog_projexn)
-
-            data_vals = [row[f.name] for f in arcpy.ListFields(fc_linshps) if f.name in data_fields]
-            row_vals = [polyline, shp_source] + data_vals
-            # pdb.set_trace()
-            
-            route_cur.insertRow(tuple(row_vals))
+        shape_coords = self.get_shape_coords(df_shapes_aug) # {shape_id: (lons, lats, shape source)}
+        
+        # many rows (e.g. different service ids) can share the same shape, so build each shape's
+        # line only once.
+        shape_lines = {} # {shape_id: (polyline, shape source)}
+        for shape_id in set(shape_ids):
+            lons, lats, shp_source = shape_coords[shape_id]
+            array = arcpy.Array([arcpy.Point(x, y) for x, y in zip(lons.tolist(), lats.tolist())])
+            shape_lines[shape_id] = (arcpy.Polyline(array, self.spatialref_wgs), shp_source)
+        
+        # attribute values as tuples already in cursor field order, (val1, val2...)
+        data_rows = data_df[output_fields].itertuples(index=False, name=None)
+        for shape_id, data_vals in zip(shape_ids, data_rows):
+
+            polyline, shp_source = shape_lines[shape_id]
+            route_cur.insertRow((polyline, shp_source) + data_vals)
 
         del route_cur
+        
+        self.project_to_workspace(fc_linshps_wgs, fc_linshps)
 
     def make_stop_pts(self):
         '''feature class of stop points, with fields for:
@@ -238,97 +474,80 @@ class MakeGTFSGISData(object):
 
 
         # cols needed for making table, from appropraite GTFS input files
-        cols_stops = [self.f_stopid, self.f_stoplat, self.f_stoplon]
         cols_stoptimes = [self.f_stopid, self.f_tripid, self.f_stopseq]
 
         # make dataframe of stops with count of trips, by service type, at each stop.
-        df_stops = self.txt_to_df(self.txt_stops, cols_stops)
-        df_stoptimes = self.txt_to_df(self.txt_stoptimes, cols_stoptimes)
-        df_trips = self.df_trips[[self.f_tripid, self.f_routeid, self.f_svc_id]]
-        df_routes = self.df_routes[[self.f_routeid, self.f_routesname]]
+        # trips, routes, and stops each have one row per ID, so index them by ID and join them onto
+        # stop times, which is cheaper than a chain of merges.
+        df_stoptimes = self.df_stoptimes[cols_stoptimes]
+        df_trips_idx = self.df_trips[[self.f_tripid, self.f_routeid, self.f_svc_id]].set_index(self.f_tripid)
+        df_routes_idx = self.df_routes[[self.f_routeid, self.f_routesname]].set_index(self.f_routeid)
+        df_stops_idx = self.df_stops.set_index(self.f_stopid)
 
-        df_st = df_stops.merge(df_stoptimes, on = self.f_stopid) \
-                .merge(df_trips, on=self.f_tripid) \
-                .merge(df_routes, on=self.f_routeid)
+        df_st = df_stoptimes.join(df_trips_idx, on=self.f_tripid, how='inner') \
+                .join(df_routes_idx, on=self.f_routeid, how='inner') \
+                .join(df_stops_idx, on=self.f_stopid, how='inner')
 
         # add column with name of agency, in case you merge stop files together.
         df_st[self.f_agencyname] = self.agency
         
-        # make dataframe (via dict) that results in field in main df that lists all lines using a stop
-        stop_records1 = df_st[[self.f_stopid, self.f_routesname]].to_dict('records')
-        
-        stop_linelist_dict = {}  # {stop_id: [line1, line2...]}
-        for d in stop_records1:
-            stop_id = d[self.f_stopid]
-            routename = str(d[self.f_routesname])
-            if stop_linelist_dict.get(stop_id) is None:
-                stop_linelist_dict[stop_id] = [routename]
-            elif routename in stop_linelist_dict[stop_id]:
-                continue
-            else:
-                stop_linelist_dict[stop_id].append(routename)
-                    
-        
-        stop_linelist_dict2 = {k: ';'.join(v) for k, v in stop_linelist_dict.items()}
-        df_stop_linelist = pd.DataFrame.from_dict(stop_linelist_dict2, orient='index').reset_index()
-        df_stop_linelist = df_stop_linelist.rename(columns={0:'stoplines'})
+        # make dataframe with field listing all lines using each stop, in the order lines first appear.
+        # routes with no short name show up as blanks in the list.
+        df_stop_linelist = df_st[[self.f_stopid, self.f_routesname]].fillna({self.f_routesname: ''}) \
+            .astype({self.f_routesname: str}).drop_duplicates() \
+            .groupby(self.f_stopid, sort=False)[self.f_routesname].agg(';'.join) \
+            .rename(self.f_lines_stop).reset_index()
         
 
         groupby_cols = [self.f_stopid, self.f_agencyname, self.f_svc_id, self.f_stoplat, self.f_stoplon]
         out_cols = groupby_cols + [self.f_stopseq]
-        df_stops_out = df_st[out_cols].groupby(groupby_cols).count().reset_index()
-        df_stops_out = df_stops_out.merge(df_stop_linelist, left_on=self.f_stopid, right_on='index')
-        del df_stops_out['index']
+        df_stops_out = df_st[out_cols].groupby(groupby_cols, observed=True).count().reset_index()
+        df_stops_out = df_stops_out.merge(df_stop_linelist, on=self.f_stopid)
         
         df_stops_out = df_stops_out.rename(columns = {self.f_stopseq: self.f_tripcnt_day})
         
+        # stop-level join table is no longer needed; free it before building the feature class
+        del df_st, df_stoptimes, df_stop_linelist
+        
 
         # write to point feature class
         fc_stop_pts = "GTFSstops_{}{}".format(self.agency_formatted, self.data_year)
-
-        if (arcpy.Exists(fc_stop_pts)):
-            arcpy.Delete_management(fc_stop_pts)
-        	
-        #add feature class fields
-        arcpy.CreateFeatureclass_management(self.workspace, fc_stop_pts,"POINT","","","", self.sacog_projexn)
-        arcpy.AddField_management(fc_stop_pts, self.f_stopid, "TEXT", "", "", 40)
-        arcpy.AddField_management(fc_stop_pts, self.f_agencyname , "TEXT", "", "", 40)
-        arcpy.AddField_management(fc_stop_pts, self.f_svc_id , "TEXT", "", "", 50)
-        arcpy.AddField_management(fc_stop_pts, self.f_tripcnt_day, "SHORT",)
-        arcpy.AddField_management(fc_stop_pts, self.f_lines_stop , "TEXT", "", "", 140)
-        
-        data_records = df_stops_out.to_dict('records') # [{colA:val1, ColB: val1},{ColA:val2, ColB:val2}...]
-
-        data_fields = [col for col in df_stops_out.columns]
-        output_fields = [f.name for f in arcpy.ListFields(fc_stop_pts) if f.name in data_fields]
-        
-        stoppnt_cur = arcpy.da.InsertCursor(fc_stop_pts,[self.f_esri_shape] + output_fields)
-        # pdb.set_trace()
+        fc_stop_pts_wgs = os.path.join(self.mem_workspace, fc_stop_pts) # unprojected stops
+
+        if (arcpy.Exists(fc_stop_pts_wgs)):
+            arcpy.Delete_management(fc_stop_pts_wgs)
+        
+        # build one numpy array of all stops and bulk-load it, instead of inserting one row at a time.
+        # the string dtype widths set the output text field lengths; longer values (e.g. a stoplines
+        # value with many lines) are truncated to fit. Trip count is a 32-bit (LONG) field, since numpy
+        # silently wraps values that don't fit in a 16-bit field.
+        f_xy = 'XY'
+        stop_dtype = [(f_xy, '<f8', 2), (self.f_stopid, '<U40'), (self.f_agencyname, '<U40'),
+                      (self.f_svc_id, '<U50'), (self.f_tripcnt_day, '<i4'), (self.f_lines_stop, '<U140')]
+        
+        stop_arr = np.empty(len(df_stops_out), dtype=stop_dtype)
+        stop_arr[f_xy][:, 0] = df_stops_out[self.f_stoplon].to_numpy(dtype=np.float64)
+        stop_arr[f_xy][:, 1] = df_stops_out[self.f_stoplat].to_numpy(dtype=np.float64)
+        stop_arr[self.f_tripcnt_day] = df_stops_out[self.f_tripcnt_day].to_numpy()
+        for fname in (self.f_stopid, self.f_agencyname, self.f_svc_id, self.f_lines_stop):
+            stop_arr[fname] = df_stops_out[fname].astype(str).to_numpy()
 
         print("writing stop points to feature class {}...".format(fc_stop_pts))
-        for row in data_records:
-
-            lat = row[self.f_stoplat]
-            lon = row[self.f_stoplon]
-            pt = arcpy.Point(lon, lat)  
-            stop_point = arcpy.PointGeometry(pt, self.spatialref_wgs)
-            if self.sacog_projexn != self.spatialref_wgs:
-                stop_point = stop_point.projectAs(self.sacog_projexn)
-
-            try:
-                data_vals = [row[fname] for fname in output_fields]
-                row_vals = [stop_point] + data_vals
-                stoppnt_cur.insertRow(tuple(row_vals))
-            except RuntimeError:
-                print("Could not insert value {} because it is long. Skipping to next value..." \
-                      .format(row[self.f_lines_stop]))
-                    
-                row[self.f_lines_stop] = "NA"
-                data_vals = [row[fname] for fname in output_fields]
-                row_vals = [stop_point] + data_vals
-                
-
-        del stoppnt_cur
+        arcpy.da.NumPyArrayToFeatureClass(stop_arr, fc_stop_pts_wgs, [f_xy], self.spatialref_wgs)
+        
+        self.project_to_workspace(fc_stop_pts_wgs, fc_stop_pts)
+    
+    def project_to_workspace(self, in_fc_wgs, out_fc_name):
+        '''projects a WGS1984 feature class to SACOG's coordinate system, writing the
+        result to the GIS workspace. Projecting the whole feature class in one
+        geoprocessing call is much faster than calling projectAs on each feature.'''
+        out_fc = os.path.join(self.workspace, out_fc_name)
+        
+        if (arcpy.Exists(out_fc)):
+            arcpy.Delete_management(out_fc)
+            
+        arcpy.Project_management(in_fc_wgs, out_fc, self.sacog_projexn)
+        arcpy.Delete_management(in_fc_wgs)
     
     def augment_shpstbl(self):
         '''if shapes.txt file does not have the shape for a route, then use its
@@ -338,19 +557,26 @@ class MakeGTFSGISData(object):
         shapes
         
         '''
+        if self._df_shapes_aug is not None:
+            return self._df_shapes_aug
         
         # make a "pseudo shapes table" with fields normally in shapes.txt, but built from
         # stop_times
         
         # make table with trip_id, shape_id, stop_id, stop_lat, stop_long, stop_seq
         # by joining trips.txt and stop_times.txt tables
-        stopcols = [self.f_stopid, self.f_stoplat, self.f_stoplon]
-        df_stops = self.txt_to_df(self.txt_stops, usecolumns=stopcols)
+        df_stops = self.df_stops
         
         stoptime_cols = [self.f_tripid, self.f_stopid, self.f_stopseq]
-        df_stoptimes = self.txt_to_df(self.txt_stoptimes, usecolumns=stoptime_cols)
-        
-        df_merge = self.df_trips.merge(df_stoptimes, on=self.f_tripid) \
+        df_stoptimes = self.df_stoptimes[stoptime_cols]
+        
+        # one trip is enough to trace a shape's stops, so only join each shape's first trip to
+        # stop_times instead of building a stop-level table for every trip in the feed.
+        # trips with no stop times can't trace a shape, so the first trip is picked from trips that have them.
+        df_shptrips = self.df_trips[[self.f_tripid, self.f_shapeid]]
+        df_shptrips = df_shptrips.loc[df_shptrips[self.f_tripid].isin(df_stoptimes[self.f_tripid])] \
+            .drop_duplicates(subset=self.f_shapeid)
+        df_merge = df_shptrips.merge(df_stoptimes, on=self.f_tripid) \
             .merge(df_stops, on=self.f_stopid)
             
         
@@ -372,57 +598,36 @@ class MakeGTFSGISData(object):
         # try making shapes df from shapes table. If successful, fill in missing
         # shapes with stoptime-based shapes. If fail, just use stoptime-based shapes
         try:
-            shptxtcols = [self.f_shapeid, self.f_pt_lat, self.f_pt_lon, self.f_pt_seq]
-            df_shapes = self.txt_to_df(self.txt_shapes, usecolumns=shptxtcols)
-            df_shapes[self.f_shpsrc] = 'shapestxt'
+            df_shapes = self.df_shapes.assign(**{self.f_shpsrc: 'shapestxt'})
             
             shptxt_shpids = df_shapes[self.f_shapeid].unique()  # shape ids in shapes.txt
             
-            tripshp_ids = self.df_trips[self.f_shapeid].unique() # shape ids in the trip table
-
-            for shpid in tripshp_ids:
-                if shpid not in shptxt_shpids:  # if shape id missing from shapes.txt, then add it from the stop-times based shape.
-                    shp_to_append = df_shpfrmstops.loc[df_shpfrmstops[self.f_shapeid] == shpid]
-                    df_shapes.append(shp_to_append)
-                else:
-                    continue
+            # if a trip's shape id is missing from shapes.txt, then add it from the stop-times based shapes.
+            # (df_shpfrmstops is built from the trip table, so it only has shape ids used by trips)
+            shps_to_append = df_shpfrmstops.loc[~df_shpfrmstops[self.f_shapeid].isin(shptxt_shpids)]
+            df_shapes = pd.concat([df_shapes, shps_to_append], ignore_index=True)
         except FileNotFoundError:
             print("Could not find shapes.txt file. Using stop points to draw shapes." \
                   "lines may not follow actual streets.")
             df_shapes = df_shpfrmstops # if no shapes.txt, then use stoptimes-derived line shapes
         
         # output fields = shape id, lat, long, sequence, shape source
+        self._df_shapes_aug = df_shapes
         return df_shapes
         
                 
         
         
         
-    def fix_time_stamp(self, str_time_in):
-        '''if time stamp hour is greater than 23, it fixes it so hours only
-        range from zero to 23'''
-
-        try:
-            str_split = [int(x) for x in str_time_in.split(':')]
-            hour = str_split[0]
-            mins = str_split[1]
-            secs = str_split[2]
-            
-            str_date = dt.datetime.strftime(dt.datetime.now(),'%Y-%m-%d')
-            
-            if hour > 23:
-                
-                hourfixed = hour - 24
-                tstamp_fixed = '{} {}:{}:{}'.format(str_date, hourfixed, mins, secs)
-            else:
-                tstamp_fixed = '{} {}:{}:{}'.format(str_date, hour, mins, secs)
-                
-            return tstamp_fixed  
-        except AttributeError:
-            pass
+    def gtfs_time_to_secs(self, str_times):
+        '''converts series of GTFS "hh:mm:ss" time strings to a numpy array of float seconds after midnight,
+        parsing the whole series in one vectorized call. Hours past 23 (trips running past
+        midnight) are kept, e.g. "25:10:00" = 90600. Blank times are returned as NaN.'''
+        secs = pd.to_timedelta(str_times).dt.total_seconds()
+        return secs.to_numpy(dtype='float64', na_value=np.nan)
             
         
-    def get_prd_opdata(self, str_prd_start, str_prd_end, use_whole_day=False, groupby_attrs=[]):
+    def get_prd_opdata(self, str_prd_start, str_prd_end, use_whole_day=False, groupby_attrs=None):
         '''for a given time period, get:
             -count of trips starting within time period
             -average headway within period
@@ -445,7 +650,9 @@ class MakeGTFSGISData(object):
         f_st_first_trip = 'st_first_trip'
         f_st_last_trip = 'st_last_trip'
         f_svc_span_mins = 'svc_span_mins'
-        f_tripend = 'trip_end_time'
+        f_depart_secs = 'depart_secs' # departure time as seconds after midnight, 86400 or more if after midnight
+        f_arrive_secs = 'arrive_secs' # arrival time as seconds after midnight, 86400 or more if after midnight
+        f_first_stop = 'first_stop' # True if stop is first stop of trip
         f_trip_ttmins = 'tt_mins{}'.format(f_prdprefix) # travel time in minutes for trip
         f_headway = 'headway{}'.format(f_prdprefix)
         f_headway_day = 'hdwy_fullday'
@@ -459,44 +666,49 @@ class MakeGTFSGISData(object):
         prd_dur_mins = (ts_prd_end - ts_prd_start).seconds / 60 # duration of time period in minutes
         
         
-        #convert datetimes to time
-        ts_prd_start = ts_prd_start.time()
-        ts_prd_end = ts_prd_end.time()
+        # period start and end as seconds after midnight
+        prd_start_secs = ts_prd_start.hour * 3600 + ts_prd_start.minute * 60 + ts_prd_start.second
+        prd_end_secs = ts_prd_end.hour * 3600 + ts_prd_end.minute * 60 + ts_prd_end.second
         
         # make stoptimes dataframe with specified columns
         cols = [self.f_tripid, self.f_depart_time, self.f_arrive_time, self.f_stopseq]
-        df_1 = self.txt_to_df(self.txt_stoptimes, usecolumns=cols) 
-        
-        # some RT time stamps have midnight hour as 24, not zero. this fixes it.
-        for time_field in (self.f_depart_time, self.f_arrive_time):
-            df_1[time_field] = df_1[time_field].apply(lambda x: self.fix_time_stamp(x))
-            
+        df_1 = self.df_stoptimes[cols].copy()
+        
+        # times as seconds after midnight. Some time stamps have hours of 24 or more for service after
+        # midnight; these seconds are kept as-is so travel times of trips that run past midnight are right.
+        for time_field, f_secs in ((self.f_depart_time, f_depart_secs), (self.f_arrive_time, f_arrive_secs)):
+            df_1[f_secs] = self.gtfs_time_to_secs(df_1[time_field])
+        
+        # departure times formatted as times instead of strings, for the time period filter and
+        # first/last trip times. Times after midnight wrap back to hour zero.
+        base_date = pd.Timestamp(dt.date.today())
+        depart_day_secs = df_1[f_depart_secs].to_numpy() % 86400 # seconds after midnight, from 0 to 86399
+        df_1[f_tripstart] = base_date + pd.to_timedelta(depart_day_secs, unit='s')
             
-        # create columes where times formatted as times instead of strings
-        df_1[f_tripstart] = pd.to_datetime(df_1[self.f_depart_time])
-        df_1[f_tripend] = pd.to_datetime(df_1[self.f_arrive_time])
+        # flag each trip's first stop. Stop times are sorted by trip and stop sequence,
+        # so a trip's first stop is wherever the trip_id changes from the previous row.
+        df_1[f_first_stop] = df_1[self.f_tripid].ne(df_1[self.f_tripid].shift())
         
         
         # filter to only get departure times within specified time period
-        df_1 = df_1.loc[(df_1[f_tripstart].dt.time >= ts_prd_start) \
-                                          & (df_1[f_tripstart].dt.time < ts_prd_end)]
+        df_1 = df_1.loc[(depart_day_secs >= prd_start_secs) & (depart_day_secs < prd_end_secs)]
         
         # make df of each trip's end time
-        df_tripends = df_1[[self.f_tripid, f_tripend, self.f_stopseq]] \
-            .groupby(self.f_tripid).max().reset_index()
+        df_tripends = df_1[[self.f_tripid, f_arrive_secs]].groupby(self.f_tripid, observed=True).max().reset_index()
         
         
         # filter to only get records for departing first stop of trip
-        first_stop = df_1[self.f_stopseq].min()
-        df_tripstarts = df_1.loc[df_1[self.f_stopseq] == first_stop]
+        df_tripstarts = df_1.loc[df_1[f_first_stop]]
+        
+        # stop-level table is no longer needed once trip starts and ends are extracted
+        del df_1
         
         # add end point data to df of trip starts, resulting in table with trip id, trip start time, trip end time
-        cols = [self.f_tripid, f_tripstart]
+        cols = [self.f_tripid, f_tripstart, f_depart_secs]
         df_startend = df_tripstarts[cols].merge(df_tripends, on=self.f_tripid)
         
-        # get each trip's end-to-end travel time as time delta as float number
-        df_startend[f_trip_ttmins] = df_startend[f_tripstart] - df_startend[f_tripend] 
-        df_startend[f_trip_ttmins] = df_startend[f_trip_ttmins].dt.seconds/3600
+        # get each trip's end-to-end travel time in minutes
+        df_startend[f_trip_ttmins] = (df_startend[f_arrive_secs] - df_startend[f_depart_secs]) / 60
         
 
         # merges to tag route and trip data to each stop time
@@ -508,7 +720,7 @@ class MakeGTFSGISData(object):
         gbcols = [self.f_routeid, self.f_shapeid, self.f_tripdir, self.f_svc_id]
         out_cols = gbcols + [self.f_routesname, f_tripstart, f_trip_ttmins]
         
-        df_groupby = df_merged[out_cols].groupby(gbcols)
+        df_groupby = df_merged[out_cols].groupby(gbcols, observed=True)
         
         #get count of trips and sum of travel time in period
         aggcol_namedict = {'count':f_tripcnt_prd, "min": f_st_first_trip, "max": f_st_last_trip}
@@ -544,25 +756,59 @@ class MakeGTFSGISData(object):
             df_out[f_headway] = prd_dur_mins / df_out[f_tripcnt_prd]  
         
         # attach calendar dates to output, if calendar.txt is available
-        try:
-            cols_cal = [self.f_svc_id, self.start_date, self.end_date]
-            df_cal = pd.read_csv(self.txt_calendar)[cols_cal]
-            df_cal[self.f_svc_id] = df_cal[self.f_svc_id].astype('str')
+        if self.txt_calendar.exists():
+            cols_cal = [self.f_svc_id, self.f_start_date, self.f_end_date]
+            df_cal = pd.read_csv(self.txt_calendar, usecols=cols_cal, dtype={self.f_svc_id: str})
             
             df_out = df_out.merge(df_cal, on=self.f_svc_id)
-        except:
+        else:
             print("warning: calendar.txt not found. Output will not contain info on when GTFS data cover.")
-            pass
         
         return df_out
         
         
     
 #=======================RUN FUNCTIONS======================================
+def get_output_name(gtfs_folder, year):
+    '''agency name and year label that a GTFS folder's output feature classes and CSV are named
+    with, read from agency.txt the same way MakeGTFSGISData does'''
+    df_agency = pd.read_csv(os.path.join(gtfs_folder, 'agency.txt'), usecols=['agency_name'], dtype=str, nrows=1)
+    agency_formatted = df_agency['agency_name'][0].translate(MakeGTFSGISData.forbidden_chars)
+    return "{}{}".format(agency_formatted, year)
+
+
+def run_one(gtfs_folder, gis_fgdb, year, output_type, start_time, end_time, use_entire_day=False,
+            weekdays_only=False, use_parquet_cache=False, make_trip_shps=True, make_stop_pt_shps=True):
+    '''Make GIS or CSV outputs for a single operator's GTFS folder. Kept at module level so it
+    can be sent to worker processes when several folders are run at once.'''
+    gtfso = MakeGTFSGISData(gtfs_folder, gis_fgdb, year, weekdays_only, use_parquet_cache)
+    
+    if output_type == 'gis':
+        if make_trip_shps:
+            gtfso.make_trip_shp()
+        if make_stop_pt_shps:
+            gtfso.make_stop_pts()
+        return gis_fgdb
+    else:
+        str_tstart = ''.join(start_time.split(':')[:2])
+        str_tend = ''.join(end_time.split(':')[:2])
+        f_prdprefix = "{}_{}".format(str_tstart, str_tend)
+        
+        opdir = os.path.dirname(gtfs_folder)
+        
+        df = gtfso.get_prd_opdata(start_time, end_time, use_entire_day, groupby_attrs=['route_id', 'route_short_name', 'shape_id'])
+        
+        # name by agency and year, like the GIS outputs, so operators whose folders share a parent
+        # folder don't overwrite each other's CSV
+        out_csv = os.path.join(opdir,"gtfs_{}{}_opdata{}.csv".format(gtfso.agency_formatted, year, f_prdprefix))
+        df.to_csv(out_csv, index=False)
+        return out_csv
+
+
 if __name__ == '__main__':
-    # folder containing GTFS text files
-    gtfs_folder = r'Q:\SACSIM23\Network\TransitNetwork\GTFS\SRTD'
-    # gtfs_folder = r'Q:\SACSIM19\2020MTP\transit\Sidewalk Labs\OperatorData_SWL\SRTD\2020_4Fall\google_transit'
+    # folder(s) containing GTFS text files, one folder per operator
+    gtfs_folders = [r'Q:\SACSIM23\Network\TransitNetwork\GTFS\SRTD']
+    # gtfs_folders = [r'Q:\SACSIM19\2020MTP\transit\Sidewalk Labs\OperatorData_SWL\SRTD\2020_4Fall\google_transit']
     
     # ESRI file geodatabase you want output files to appear in
     gis_fgdb = r'Q:\SACSIM23\Network\SM23GIS\SM23Testing.gdb'
@@ -580,38 +826,60 @@ if __name__ == '__main__':
     # instead of getting op data for specified period of day
     # This overrides the start_time and end_time variable values.
     use_entire_day = False 
+    
+    # if True, only include trips whose service runs on every weekday, per calendar.txt
+    weekdays_only = False
+    
+    # if True, parsed GTFS tables are saved as parquet files in gtfs_folder so later runs load faster
+    use_parquet_cache = False
 
     # only applicable if outputting to GIS. Indicate if you want lines, stops, or both in outputs
     make_trip_shps = True # whether to make GIS lines for each trip shape
     make_stop_pt_shps = True # whether to make GIS point file of operator's stop locations
     
+    # max number of operators to process at once in separate processes; set to 1 to run one at a time
+    max_workers = os.cpu_count()
+    
     #----------BEGIN SCRIPT-----------------
     
     if use_entire_day:
         start_time = '00:00:00' # starting at or after this time
         end_time = '23:59:00' # and ending before this time
-    
-    str_tstart = ''.join(start_time.split(':')[:2])
-    str_tend = ''.join(end_time.split(':')[:2])
-    f_prdprefix = "{}_{}".format(str_tstart, str_tend)
-    
-    opdir = os.path.dirname(gtfs_folder)
 
     output_type = input("choose output type (csv, gis): ")
     output_type = output_type.lower()
     
-    gtfso = MakeGTFSGISData(gtfs_folder, gis_fgdb, year)
-    
     if output_type not in ('csv', 'gis'):
         raise Exception("Invalid output type. Please enter either 'gis' or 'csv'.")
-    elif output_type == 'gis':
-        if make_trip_shps:
-            gtfso.make_trip_shp()
-        if make_stop_pt_shps:
-            gtfso.make_stop_pts()
+    
+    # outputs are named by agency and year, so two folders for the same agency and year would write
+    # to the same feature classes (or the same CSV, if the folders share a parent folder).
+    # Check before running anything so no outputs get overwritten.
+    folders_x_output = {}
+    for folder in gtfs_folders:
+        out_name = get_output_name(folder, year)
+        out_key = out_name if output_type == 'gis' else (os.path.dirname(folder), out_name)
+        folders_x_output.setdefault(out_key, []).append(folder)
+    
+    dup_folders = [folders for folders in folders_x_output.values() if len(folders) > 1]
+    if dup_folders:
+        raise Exception("These GTFS folders would write to the same outputs and overwrite each other's " \
+                        "results. Run them separately with different year labels: {}".format(dup_folders))
+    
+    run_args = (output_type, start_time, end_time, use_entire_day, weekdays_only, use_parquet_cache,
+                make_trip_shps, make_stop_pt_shps)
+    
+    if len(gtfs_folders) == 1 or max_workers == 1:
+        out_paths = [run_one(folder, gis_fgdb, year, *run_args) for folder in gtfs_folders]
+    else:
+        # each operator is independent and writes its own agency-named feature classes or CSV,
+        # so operators can be run in separate processes without stepping on each other.
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(gtfs_folders))) as executor:
+            futures = [executor.submit(run_one, folder, gis_fgdb, year, *run_args) for folder in gtfs_folders]
+            out_paths = [f.result() for f in futures]
+    
+    if output_type == 'gis':
         print(f"Success! Results are in {gis_fgdb}")
     else:
-        df = gtfso.get_prd_opdata(start_time, end_time, use_entire_day, groupby_attrs=['route_id', 'route_short_name', 'shape_id'])
-        out_csv = os.path.join(opdir,"gtfs_{}_opdata{}.csv".format(os.path.basename(opdir), f_prdprefix))
-        df.to_csv(out_csv, index=False)
-        print(f"Success! Results are in {out_csv}")
+        for out_path in out_paths:
+            print(f"Success! Results are in {out_path}")